@@ -0,0 +1,114 @@
+# cython: language_level=3, boundscheck=False, wraparound=False, cdivision=True
+"""Compiled versions of the color math in hue_lamp.
+
+Gamuts are the flat float tuples built by hue_lamp._make_gamut.
+"""
+from libc.math cimport pow
+
+# offsets into a gamut, matching hue_lamp._GAMUT_LAYOUT
+cdef enum:
+    BLUE = 4
+    IN_GAMUT = 6
+    EDGE_RG = 11
+    EDGE_BR = 16
+    EDGE_GB = 21
+    GAMUT_SIZE = 26
+
+GAMUT_LAYOUT = (BLUE, IN_GAMUT, EDGE_RG, EDGE_BR, EDGE_GB, GAMUT_SIZE)
+
+# Wide RGB D65, as in hue_lamp._RGB2XYZ
+cdef double RGB2XYZ[3][3]
+RGB2XYZ[0][:] = [0.664511, 0.154324, 0.162028]
+RGB2XYZ[1][:] = [0.283881, 0.668433, 0.047685]
+RGB2XYZ[2][:] = [0.000088, 0.072310, 0.986039]
+
+cdef double gamma_correction(double value):
+    """Perform hue-recommended gamma correction on a unipolar float."""
+    if value > 0.04045:
+        return pow((value + 0.055) / 1.055, 2.4)
+    else:
+        return value / 12.92
+
+cdef bint xy_color_in_gamut(double x, double y, tuple gamut):
+    """Return True if the color with coordinates x,y is in gamut."""
+    cdef double cbx = x - <double>gamut[BLUE]
+    cdef double cby = y - <double>gamut[BLUE + 1]
+    cdef double gby = gamut[IN_GAMUT]
+    cdef double bgx = gamut[IN_GAMUT + 1]
+    cdef double bry = gamut[IN_GAMUT + 2]
+    cdef double rbx = gamut[IN_GAMUT + 3]
+    cdef double inv_denom = gamut[IN_GAMUT + 4]
+    cdef double a = (gby * cbx + bgx * cby) * inv_denom
+    cdef double b = (bry * cbx + rbx * cby) * inv_denom
+    return a >= 0. and b >= 0. and a + b <= 1.
+
+cdef double project(tuple gamut, int i, double px, double py, double[2] out):
+    """Project onto the gamut edge at index i, returning squared distance."""
+    cdef double ax = gamut[i]
+    cdef double ay = gamut[i + 1]
+    cdef double abx = gamut[i + 2]
+    cdef double aby = gamut[i + 3]
+    cdef double t = ((px - ax) * abx + (py - ay) * aby) * <double>gamut[i + 4]
+    t = 0.0 if t < 0.0 else (1.0 if t > 1.0 else t)
+    out[0] = ax + abx * t
+    out[1] = ay + aby * t
+    return (px - out[0]) * (px - out[0]) + (py - out[1]) * (py - out[1])
+
+cdef void get_closest_color_in_gamut(
+        double x, double y, tuple gamut, double[2] out):
+    cdef double p0[2]
+    cdef double p1[2]
+    cdef double p2[2]
+    cdef double d0 = project(gamut, EDGE_RG, x, y, p0)
+    cdef double d1 = project(gamut, EDGE_BR, x, y, p1)
+    cdef double d2 = project(gamut, EDGE_GB, x, y, p2)
+    if d0 <= d1 and d0 <= d2:
+        out[0], out[1] = p0[0], p0[1]
+    elif d1 <= d2:
+        out[0], out[1] = p1[0], p1[1]
+    else:
+        out[0], out[1] = p2[0], p2[1]
+
+cdef check_gamut(tuple gamut):
+    # the helpers above index the gamut without bounds checks
+    if len(gamut) != GAMUT_SIZE:
+        raise ValueError(
+            "Expected a gamut of {} floats, got {}.".format(
+                GAMUT_SIZE, len(gamut)))
+
+def coerce_into_gamut(double x, double y, tuple gamut not None):
+    """Coerce an XY color into gamut, if necessary."""
+    cdef double xy[2]
+    check_gamut(gamut)
+    if xy_color_in_gamut(x, y, gamut):
+        return (x, y)
+    get_closest_color_in_gamut(x, y, gamut, xy)
+    return (xy[0], xy[1])
+
+def rgb_to_xy(
+        double red, double green, double blue, bint gamma_correct,
+        tuple gamut not None):
+    """Convert an RGB color to in-gamut x, y, and brightness Y."""
+    cdef double X, Y, Z, div
+    cdef double xy[2]
+    check_gamut(gamut)
+    if gamma_correct:
+        red = gamma_correction(red)
+        green = gamma_correction(green)
+        blue = gamma_correction(blue)
+
+    X = red * RGB2XYZ[0][0] + green * RGB2XYZ[0][1] + blue * RGB2XYZ[0][2]
+    Y = red * RGB2XYZ[1][0] + green * RGB2XYZ[1][1] + blue * RGB2XYZ[1][2]
+    Z = red * RGB2XYZ[2][0] + green * RGB2XYZ[2][1] + blue * RGB2XYZ[2][2]
+
+    div = X + Y + Z
+    if div == 0.:
+        xy[0] = 0.
+        xy[1] = 0.
+    else:
+        xy[0] = X / div
+        xy[1] = Y / div
+
+    if not xy_color_in_gamut(xy[0], xy[1], gamut):
+        get_closest_color_in_gamut(xy[0], xy[1], gamut, xy)
+    return xy[0], xy[1], Y
@@ -1,7 +1,14 @@
-from collections import namedtuple
+import logging
 import numpy as np
 from qhue import QhueException, Bridge
-import quickstart
+from .quickstart import quickstart
+try:
+    from . import hue_color
+except ImportError:
+    # the compiled color math hasn't been built, use the Python versions
+    hue_color = None
+
+log = logging.getLogger(__name__)
 
 
 class HueTransmitter (object):
@@ -9,7 +16,7 @@ class HueTransmitter (object):
     def __init__(self, bridge_info=None, ttime=None):
         """Initialize a transmitter, but don't start it yet."""
         if bridge_info is None:
-            self.bridge, _ = quickstart.quickstart()
+            self.bridge, _ = quickstart()
         else:
             self.bridge = Bridge(*bridge_info)
         self.lamps = get_lamps(self.bridge)
@@ -20,6 +27,38 @@ class HueTransmitter (object):
     def send_color(self, lamp_name, color_rgb, ttime=None):
         self.lamps[lamp_name].send_color(color_rgb, ttime)
 
+    def send_colors(self, colors_rgb, ttime=None):
+        """Send colors to many lamps at once.
+
+        colors_rgb: dict of RGB colors keyed by lamp name.  Without the
+        compiled color math, large groups of lamps sharing a gamut have their
+        colors converted together in one vectorized pass.
+        """
+        groups = {}
+        for lamp_name, color_rgb in colors_rgb.items():
+            lamp = self.lamps[lamp_name]
+            # keep 8-bit colors apart so stacking doesn't promote them to
+            # floats, which would then be read as unipolar
+            eight_bit = (
+                isinstance(color_rgb, np.ndarray) and
+                color_rgb.dtype == np.uint8)
+            key = (lamp.gamut, lamp.gamma_correct, eight_bit)
+            groups.setdefault(key, []).append((lamp, color_rgb))
+
+        for (gamut, gamma_correct, _), group in groups.items():
+            lamps, colors = zip(*group)
+            # the batch has a fixed cost of tens of microseconds, which only
+            # pays off against the Python rgb_to_xy for large groups
+            if hue_color is not None or len(group) < _MIN_BATCH_SIZE:
+                converted = (
+                    rgb_to_xy(color_rgb, gamut, gamma_correct)
+                    for color_rgb in colors)
+            else:
+                converted = zip(*rgb_to_xy_batch(
+                    np.array(colors), gamut, gamma_correct))
+            for lamp, (xy, bri_float) in zip(lamps, converted):
+                lamp.send_xy(xy, bri_float, ttime)
+
     def send_ct(self, lamp_name, ct, ttime=None):
         self.lamps[lamp_name].send_ct(ct, ttime)
 
@@ -32,6 +71,16 @@ _DEFAULT_TRANSITION_TIME = 4
 
 _MIN_CT = 153
 _MAX_CT = 500
+_CT_SPAN = _MAX_CT - _MIN_CT
+
+# unipolar brightness to hue brightness
+_BRI_SCALE = 255
+
+# smallest group of lamps that send_colors converts with rgb_to_xy_batch
+_MIN_BATCH_SIZE = 32
+
+# commands that _filter_command knows how to drop when they change nothing
+_FAST_PATH_KEYS = frozenset(('bri', 'xy', 'ct', 'transitiontime'))
 
 class HueLamp (object):
     """Useful interface to a Hue lamp.
@@ -55,7 +104,7 @@ class HueLamp (object):
         try:
             self.light_type, self.gamut = TYPE_AND_GAMUT_BY_MODEL_ID[model_id]
         except KeyError:
-            print "Unknown model id: {}".format(model_id)
+            log.warning("Unknown model id: %s", model_id)
             self.light_type, self.gamut = ('Unknown', GAMUT_B)
 
         self.name = info['name']
@@ -100,6 +149,34 @@ class HueLamp (object):
         Uses the last known state of the lamp to do this.  Using this helper
         should minimize traffic on the puny zigbee network.
         """
+        # not every lamp reports every field, so only on is required
+        state = self.state
+        on = state['on']
+        current_bri = state.get('bri')
+        colormode = state.get('colormode')
+        current_xy = state.get('xy')
+
+        # fast path for the common case of a lamp that is already on and a
+        # command that wouldn't change anything
+        if on and _FAST_PATH_KEYS.issuperset(commands):
+            bri = commands.get('bri')
+            ttime = commands.get('transitiontime')
+            if ttime is None:
+                ttime = self.ttime
+            if ((bri is None or (bri != 0 and bri == current_bri)) and
+                    ttime == _DEFAULT_TRANSITION_TIME):
+                xy = commands.get('xy')
+                if xy is not None:
+                    if (colormode == 'xy' and
+                            xy[0] == current_xy[0] and
+                            xy[1] == current_xy[1]):
+                        return {}
+                elif 'ct' in commands:
+                    if colormode == 'ct' and commands['ct'] == state.get('ct'):
+                        return {}
+                else:
+                    return {}
+
         try:
             bri = commands.pop('bri')
         except KeyError:
@@ -107,17 +184,17 @@ class HueLamp (object):
         else:
             if bri == 0:
                 # if the light is already off do nothing
-                if not self.on:
+                if not on:
                     return None
                 # otherwise, just turn it off
                 return {'on': False}
 
             # if we're changing the brightness, put the command back
-            if bri != self.bri:
+            if bri != current_bri:
                 commands['bri'] = bri
 
         # if the lamp is off, turn it on
-        if not self.on:
+        if not on:
             commands['on'] = True
 
         # deal with transition times
@@ -134,25 +211,27 @@ class HueLamp (object):
         # if we are setting xy color, the color is unchanged, and the last
         # command was xy, don't send it
         if ('xy' in commands and
-            self.last_colormode == 'xy' and
-            (commands['xy'] == self.xy).all()):
+            colormode == 'xy' and
+            commands['xy'][0] == current_xy[0] and
+            commands['xy'][1] == current_xy[1]):
             del commands['xy']
 
         # if we are setting color temperature, it is unchanged, and the last
         # command was color temperature, don't send it
         if ('ct' in commands and
-            self.last_colormode == 'ct' and
-            commands['ct'] == self.ct):
+            colormode == 'ct' and
+            commands['ct'] == state.get('ct')):
             del commands['ct']
 
-        print commands
+        log.debug("hue cmd: %s", commands)
         return commands
 
     def send_command(self, **commands):
         """Send a command to the lamp and update the local state upon success."""
         commands = self._filter_command(**commands)
 
-        if commands is None:
+        # nothing to send; an empty state call would be a GET to the bridge
+        if not commands:
             return
 
         # handle the case if the lamp was off when not expected to be
@@ -161,9 +240,9 @@ class HueLamp (object):
         except QhueException as err:
             if 'Device is set to off.' in err.args[0]:
                 # this can only occur if the lamp should have been on, so force
-                print "Forcing on."
+                log.info("Forcing on.")
                 commands['on'] = True
-                print commands
+                log.debug("hue cmd: %s", commands)
                 self.light.state(**commands)
 
         # update our local state based on the commands we just sent, if success
@@ -177,20 +256,24 @@ class HueLamp (object):
     def send_color(self, color_rgb, ttime=None):
         """Send a color transition to the lamp."""
         xy, bri_float = rgb_to_xy(color_rgb, self.gamut, self.gamma_correct)
+        self.send_xy(xy, bri_float, ttime)
 
+    def send_xy(self, xy, bri_float, ttime=None):
+        """Send an already converted, in-gamut xy color and brightness."""
         # this only works because 254 is the max but the bridge coerces 255
         # to 254.  Otherwise, to get full range we'd need to do 256 and coerce
         # down to 255 ourselves.
-        bri = int(bri_float*255)
+        bri = int(bri_float * _BRI_SCALE)
 
-        self.send_command(bri=bri, xy=xy, transitiontime=ttime)
+        # the bridge takes xy as a JSON list
+        self.send_command(bri=bri, xy=list(xy), transitiontime=ttime)
 
     def send_ct(self, ct, ttime=None):
         """Send a color temp transition to the lamp.
 
         ct: a float on the range [0, 1]. Higher values -> higher color temp.
         """
-        ct = int((1.0 - ct) * (_MAX_CT - _MIN_CT) + _MIN_CT)
+        ct = int((1.0 - ct) * _CT_SPAN + _MIN_CT)
 
         self.send_command(ct=ct, transitiontime=ttime)
 
@@ -199,7 +282,7 @@ class HueLamp (object):
 
         bri_float: a float on the range [0, 1].
         """
-        bri = int(bri_float*255)
+        bri = int(bri_float * _BRI_SCALE)
         self.send_command(bri=bri, transitiontime=ttime)
 
 def get_lamps(bridge):
@@ -209,23 +292,42 @@ def get_lamps(bridge):
     return {lamp.name: lamp for lamp in huelamps}
 
 def cp(x, y):
-    return np.array((x, y))
+    return (x, y)
+
+# A gamut is a single flat tuple of floats holding the red, green, and blue
+# corners followed by the constants for checking if colors are in gamut:
+# [rx, ry, gx, gy, bx, by, gy - by, bx - gx, by - ry, rx - bx, inv_denom]
+# and then the constants for projecting onto each of the red-green,
+# blue-red, and green-blue edges, 5 per edge:
+# [ax, ay, bx - ax, by - ay, 1 / |B - A|^2]
+# hue_color reads the same layout, see its GAMUT_LAYOUT.
+_BLUE = 4
+_IN_GAMUT = 6
+_EDGE_RG = 11
+_EDGE_BR = 16
+_EDGE_GB = 21
+_EDGE_SIZE = 5
+_GAMUT_SIZE = 26
+_GAMUT_LAYOUT = (_BLUE, _IN_GAMUT, _EDGE_RG, _EDGE_BR, _EDGE_GB, _GAMUT_SIZE)
 
-Gamut = namedtuple('Gamut', ('red', 'green', 'blue', 'constants'))
-
-# include constants for checking if colors are in gamut
 def _make_gamut(red, green, blue):
-    v0 = green - red
-    v1 = blue - red
-    dot00 = np.dot(v0, v0)
-    dot01 = np.dot(v0, v1)
-    dot11 = np.dot(v1, v1)
-    inv_denom = 1. / (dot00 * dot11 - dot01 * dot01)
-    return Gamut(
-        red=red,
-        green=green,
-        blue=blue,
-        constants=(v0, v1, dot00, dot01, dot11, inv_denom))
+    gby = green[1] - blue[1]
+    bgx = blue[0] - green[0]
+    bry = blue[1] - red[1]
+    rbx = red[0] - blue[0]
+    inv_denom = 1. / (gby * rbx - bgx * bry)
+
+    def edge(A, B):
+        abx = B[0] - A[0]
+        aby = B[1] - A[1]
+        return (A[0], A[1], abx, aby, 1. / (abx * abx + aby * aby))
+
+    return tuple(float(v) for v in (
+        red + green + blue +
+        (gby, bgx, bry, rbx, inv_denom) +
+        edge(red, green) +
+        edge(blue, red) +
+        edge(green, blue)))
 
 # living colors, etc
 GAMUT_A = _make_gamut(
@@ -263,56 +365,51 @@ TYPE_AND_GAMUT_BY_MODEL_ID = {
 def xy_color_in_gamut(color, gamut):
     """Return True if the color with coordinates x,y is in gamut.
 
-    From the linear algebraic basis method at
-    http://www.blackpawn.com/texts/pointinpoly/
+    Solves for the barycentric coordinates of the color with respect to the
+    gamut triangle using Cramer's rule.
     """
-    v0, v1, d00, d01, d11, inv_denom = gamut.constants
-    v2 = color - gamut.red
-    d02 = np.dot(v0, v2)
-    d12 = np.dot(v1, v2)
+    bx, by = gamut[_BLUE:_BLUE + 2]
+    gby, bgx, bry, rbx, inv_denom = gamut[_IN_GAMUT:_EDGE_RG]
+    cbx = color[0] - bx
+    cby = color[1] - by
 
-    u = (d11 * d02 - d01 + d12) * inv_denom
-    v = (d00 * d12 - d01 * d02) * inv_denom
+    a = (gby * cbx + bgx * cby) * inv_denom
+    b = (bry * cbx + rbx * cby) * inv_denom
 
-    return u >= 0. and v >= 0. and u + v < 1.
+    return a >= 0. and b >= 0. and a + b <= 1.
 
-def distance(A, B):
-    D = A - B
-    return np.sqrt(np.dot(D, D))
+def sq_distance(A, B):
+    dx = A[0] - B[0]
+    dy = A[1] - B[1]
+    return dx * dx + dy * dy
 
-def closest_point_on_line(line, P):
-    """Get the point on the line closest to P.
+def _project(edge, color):
+    """Get the point on a precomputed gamut edge closest to color.
 
-    Direct port from hue color conversion docs.
+    Returns the squared distance from color and the point.
     """
-    A, B = line
-    AB = B - A
-    ab2 = np.dot(AB, AB)
-    ap_ab = np.dot(P - A, AB)
-
-    t = ap_ab / ab2
-
-    t = max(min(t, 1.0), 0.0)
-
-    return (A + AB) * t
+    ax, ay, abx, aby, inv_ab2 = edge
+    t = ((color[0] - ax) * abx + (color[1] - ay) * aby) * inv_ab2
+    t = 0.0 if t < 0.0 else (1.0 if t > 1.0 else t)
+    pAB = (ax + abx * t, ay + aby * t)
+    return sq_distance(color, pAB), pAB
 
 def get_closest_color_in_gamut(color, gamut):
-
-    def get_best_point_for_line(line):
-        pAB = closest_point_on_line(line, color)
-        return pAB, distance(color, pAB)
-
-    lines = (
-        (gamut.red, gamut.green),
-        (gamut.blue, gamut.red),
-        (gamut.green, gamut.blue))
-
-    bests = (get_best_point_for_line(line) for line in lines)
-    best_color, _ = min(bests, key=lambda best: best[1])
-    return best_color
+    # compare squared distances; sqrt is monotonic so the order is the same
+    d0, p0 = _project(gamut[_EDGE_RG:_EDGE_RG + _EDGE_SIZE], color)
+    d1, p1 = _project(gamut[_EDGE_BR:_EDGE_BR + _EDGE_SIZE], color)
+    d2, p2 = _project(gamut[_EDGE_GB:_EDGE_GB + _EDGE_SIZE], color)
+    if d0 <= d1 and d0 <= d2:
+        return p0
+    elif d1 <= d2:
+        return p1
+    else:
+        return p2
 
 def coerce_into_gamut(color, gamut):
     """Coerce an XY color into gamut, if necessary."""
+    if hue_color is not None:
+        return hue_color.coerce_into_gamut(color[0], color[1], gamut)
     if not xy_color_in_gamut(color, gamut):
         return get_closest_color_in_gamut(color, gamut)
     else:
@@ -325,17 +422,43 @@ def gamma_correction(value):
     else:
         return value / 12.92
 
+# gamma correction precomputed for every 8-bit channel value
+_GAMMA_LUT = tuple(gamma_correction(i / 255.) for i in range(256))
+_GAMMA_LUT_ARRAY = np.array(_GAMMA_LUT)
+
+# convert to XYZ using Wide RGB D65
+_RGB2XYZ = np.array((
+    (0.664511, 0.154324, 0.162028),
+    (0.283881, 0.668433, 0.047685),
+    (0.000088, 0.072310, 0.986039)))
+
 def rgb_to_xy(color_rgb, gamut, gamma_correct=True):
     """Convert an RGB color to an in-gamut XY color and brightness.
 
     Direct port from hue color conversion docs.
+
+    color_rgb is usually unipolar floats; a uint8 array is taken as 8-bit
+    channel values and gamma corrected straight from the lookup table.
     """
-    if gamma_correct:
-        red, green, blue = (gamma_correction(c) for c in color_rgb)
+    if isinstance(color_rgb, np.ndarray) and color_rgb.dtype == np.uint8:
+        if gamma_correct:
+            red, green, blue = [_GAMMA_LUT[c] for c in color_rgb.tolist()]
+        else:
+            red, green, blue = [c / 255. for c in color_rgb.tolist()]
+        gamma_correct = False
     else:
         red, green, blue = color_rgb
 
-    # convert to XYZ using Wide RGB D65
+    if hue_color is not None:
+        x, y, Y = hue_color.rgb_to_xy(red, green, blue, gamma_correct, gamut)
+        return (x, y), Y
+
+    if gamma_correct:
+        red = gamma_correction(red)
+        green = gamma_correction(green)
+        blue = gamma_correction(blue)
+
+    # convert to XYZ using Wide RGB D65, as in _RGB2XYZ
     X = red * 0.664511 + green * 0.154324 + blue * 0.162028
     Y = red * 0.283881 + green * 0.668433 + blue * 0.047685
     Z = red * 0.000088 + green * 0.072310 + blue * 0.986039
@@ -344,10 +467,77 @@ def rgb_to_xy(color_rgb, gamut, gamma_correct=True):
     if div == 0.:
         color_xy = cp(0., 0.)
     else:
-        color_xy = cp(X / div, Y / div)
-
-    color_xy = coerce_into_gamut(color_xy, gamut)
+        color_xy = (X / div, Y / div)
+
+    return coerce_into_gamut(color_xy, gamut), Y
+
+def coerce_into_gamut_batch(xy, gamut):
+    """Coerce an (N, 2) array of XY colors into gamut, where necessary."""
+    x = xy[:, 0]
+    y = xy[:, 1]
+    gby, bgx, bry, rbx, inv_denom = gamut[_IN_GAMUT:_EDGE_RG]
+    cbx = x - gamut[_BLUE]
+    cby = y - gamut[_BLUE + 1]
+    a = (gby * cbx + bgx * cby) * inv_denom
+    b = (bry * cbx + rbx * cby) * inv_denom
+    out = ~((a >= 0.) & (b >= 0.) & (a + b <= 1.))
+    if not out.any():
+        return xy
+
+    px = x[out]
+    py = y[out]
+    # keep the closest projection so far, replacing it only when an edge is
+    # strictly closer, so ties go to the earlier edge as in the scalar path
+    best_x = best_y = best_d = None
+    for i in (_EDGE_RG, _EDGE_BR, _EDGE_GB):
+        ax, ay, abx, aby, inv_ab2 = gamut[i:i + _EDGE_SIZE]
+        t = ((px - ax) * abx + (py - ay) * aby) * inv_ab2
+        np.minimum(t, 1., out=t)
+        np.maximum(t, 0., out=t)
+        qx = t * abx
+        qx += ax
+        qy = t * aby
+        qy += ay
+        dx = px - qx
+        dy = py - qy
+        d = dx * dx
+        d += dy * dy
+        if best_d is None:
+            best_x, best_y, best_d = qx, qy, d
+        else:
+            closer = d < best_d
+            np.copyto(best_x, qx, where=closer)
+            np.copyto(best_y, qy, where=closer)
+            np.copyto(best_d, d, where=closer)
 
-    return color_xy, Y
+    xy = xy.copy()
+    xy[out, 0] = best_x
+    xy[out, 1] = best_y
+    return xy
 
+def rgb_to_xy_batch(colors_rgb, gamut, gamma_correct=True):
+    """Convert an (N, 3) array of RGB colors to in-gamut XY and brightness.
 
+    Returns an (N, 2) array of XY colors and an (N,) array of brightness.
+    As with rgb_to_xy, a uint8 array is taken as 8-bit channel values.
+    """
+    colors_rgb = np.asarray(colors_rgb)
+    if colors_rgb.dtype == np.uint8:
+        if gamma_correct:
+            rgb = _GAMMA_LUT_ARRAY[colors_rgb]
+        else:
+            rgb = colors_rgb / 255.
+    else:
+        rgb = colors_rgb.astype(np.float64)
+        if gamma_correct:
+            rgb = np.where(
+                rgb > 0.04045,
+                ((np.maximum(rgb, 0.04045) + 0.055) / 1.055)**2.4,
+                rgb / 12.92)
+
+    xyz = rgb.dot(_RGB2XYZ.T)
+    div = xyz.sum(axis=1, keepdims=True)
+    xy = np.divide(
+        xyz[:, :2], div, out=np.zeros((len(xyz), 2)), where=div != 0.)
+
+    return coerce_into_gamut_batch(xy, gamut), xyz[:, 1]
@@ -6,10 +6,19 @@ try:
 except ImportError:
     from distutils.core import setup
 
+try:
+    from Cython.Build import cythonize
+except ImportError:
+    # without cython, hue_lamp falls back to its pure Python color math
+    ext_modules = []
+else:
+    ext_modules = cythonize('ip_hue/hue_color.pyx')
+
 requires = ['qhue', 'numpy']
 
 setup(
     name='ip_hue',
     install_requires=requires,
+    ext_modules=ext_modules,
     license='GPL2',
-)
\ No newline at end of file
+)
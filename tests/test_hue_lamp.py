@@ -0,0 +1,221 @@
+import itertools
+
+import numpy as np
+import pytest
+
+from ip_hue import hue_lamp
+from ip_hue.hue_lamp import GAMUT_A, GAMUT_B, GAMUT_C
+
+RGB_COLORS = [
+    (0., 0., 0.),
+    (1., 1., 1.),
+    (1., 0., 0.),
+    (0., 1., 0.),
+    (0., 0., 1.),
+    (0.5, 0.5, 0.5),
+    (0.2, 0.9, 0.13),
+    (0.01, 0.03, 0.02),
+    (1., 0.5, 0.),
+]
+
+@pytest.mark.parametrize('gamut', (GAMUT_A, GAMUT_B, GAMUT_C))
+@pytest.mark.parametrize('gamma_correct', (True, False))
+def test_rgb_to_xy_batch_matches_rgb_to_xy(gamut, gamma_correct):
+    xys, bris = hue_lamp.rgb_to_xy_batch(
+        np.array(RGB_COLORS), gamut, gamma_correct)
+    for color_rgb, xy, bri in zip(RGB_COLORS, xys, bris):
+        expected_xy, expected_bri = hue_lamp.rgb_to_xy(
+            color_rgb, gamut, gamma_correct)
+        assert xy == pytest.approx(expected_xy, abs=1e-12)
+        assert bri == pytest.approx(expected_bri, abs=1e-12)
+
+@pytest.mark.parametrize('gamma_correct', (True, False))
+def test_rgb_to_xy_batch_matches_rgb_to_xy_for_8_bit(gamma_correct):
+    colors = np.array(
+        [(0, 0, 0), (255, 255, 255), (255, 0, 0), (10, 128, 200)],
+        dtype=np.uint8)
+    xys, bris = hue_lamp.rgb_to_xy_batch(colors, GAMUT_B, gamma_correct)
+    for color_rgb, xy, bri in zip(colors, xys, bris):
+        expected_xy, expected_bri = hue_lamp.rgb_to_xy(
+            color_rgb, GAMUT_B, gamma_correct)
+        assert xy == pytest.approx(expected_xy, abs=1e-12)
+        assert bri == pytest.approx(expected_bri, abs=1e-12)
+        unipolar_xy, _ = hue_lamp.rgb_to_xy(
+            color_rgb / 255., GAMUT_B, gamma_correct)
+        assert xy == pytest.approx(unipolar_xy, abs=1e-12)
+
+
+class FakeLamp (object):
+    gamma_correct = True
+
+    def __init__(self, gamut):
+        self.gamut = gamut
+        self.sent = None
+
+    def send_xy(self, xy, bri_float, ttime=None):
+        self.sent = (tuple(xy), bri_float)
+
+@pytest.mark.parametrize('batch', (False, True))
+def test_send_colors_mixed_8_bit_and_float(batch, monkeypatch):
+    if batch:
+        monkeypatch.setattr(hue_lamp, 'hue_color', None)
+        monkeypatch.setattr(hue_lamp, '_MIN_BATCH_SIZE', 1)
+    transmitter = object.__new__(hue_lamp.HueTransmitter)
+    transmitter.lamps = {'a': FakeLamp(GAMUT_B), 'b': FakeLamp(GAMUT_B)}
+    colors = {'a': np.array((255, 0, 0), dtype=np.uint8), 'b': (.5, .5, .5)}
+
+    transmitter.send_colors(colors)
+
+    for name, color_rgb in colors.items():
+        expected_xy, expected_bri = hue_lamp.rgb_to_xy(color_rgb, GAMUT_B)
+        xy, bri = transmitter.lamps[name].sent
+        assert xy == pytest.approx(expected_xy, abs=1e-12)
+        assert bri == pytest.approx(expected_bri, abs=1e-12)
+
+
+def _gamut_cases(name, gamut):
+    """In and out of gamut colors for a gamut, with the expected coerced xy.
+
+    Colors just inside each edge and at the centroid are unchanged.  Colors
+    just outside the middle of an edge coerce to the middle of that edge, and
+    colors out past a corner coerce to the corner.
+    """
+    corners = [gamut[0:2], gamut[2:4], gamut[4:6]]
+    cx = sum(c[0] for c in corners) / 3.
+    cy = sum(c[1] for c in corners) / 3.
+    cases = [(name, gamut, (cx, cy), True, (cx, cy))]
+    for i, (ax, ay) in enumerate(corners):
+        bx, by = corners[(i + 1) % 3]
+        mx, my = (ax + bx) / 2., (ay + by) / 2.
+        # unit normal to the edge, pointing away from the centroid
+        nx, ny = by - ay, ax - bx
+        norm = (nx * nx + ny * ny) ** 0.5
+        nx, ny = nx / norm, ny / norm
+        if nx * (mx - cx) + ny * (my - cy) < 0.:
+            nx, ny = -nx, -ny
+        inside = (mx - 1e-6 * nx, my - 1e-6 * ny)
+        outside = (mx + 1e-3 * nx, my + 1e-3 * ny)
+        cases.append((name, gamut, inside, True, inside))
+        cases.append((name, gamut, outside, False, (mx, my)))
+        beyond = (ax + 0.05 * (ax - cx), ay + 0.05 * (ay - cy))
+        cases.append((name, gamut, beyond, False, (ax, ay)))
+    return cases
+
+GAMUT_CASES = (
+    _gamut_cases('A', GAMUT_A) +
+    _gamut_cases('B', GAMUT_B) +
+    _gamut_cases('C', GAMUT_C))
+
+def _case_id(case):
+    name, _, xy, in_gamut, _ = case
+    return '{}-({:.4f},{:.4f})-{}'.format(
+        name, xy[0], xy[1], 'in' if in_gamut else 'out')
+
+@pytest.fixture(params=('python', 'compiled'))
+def implementation(request, monkeypatch):
+    """Run a test against the Python and the compiled color math."""
+    if request.param == 'python':
+        monkeypatch.setattr(hue_lamp, 'hue_color', None)
+    elif hue_lamp.hue_color is None:
+        pytest.skip('hue_color extension is not built')
+    return request.param
+
+@pytest.mark.parametrize('case', GAMUT_CASES, ids=_case_id)
+def test_xy_color_in_gamut(case):
+    _, gamut, xy, in_gamut, _ = case
+    assert hue_lamp.xy_color_in_gamut(xy, gamut) == in_gamut
+
+@pytest.mark.parametrize('case', GAMUT_CASES, ids=_case_id)
+def test_coerce_into_gamut(case, implementation):
+    _, gamut, xy, _, expected = case
+    coerced = hue_lamp.coerce_into_gamut(xy, gamut)
+    assert coerced == pytest.approx(expected, abs=1e-12)
+
+@pytest.mark.parametrize('name', ('A', 'B', 'C'))
+def test_coerce_into_gamut_batch(name):
+    cases = [case for case in GAMUT_CASES if case[0] == name]
+    gamut = cases[0][1]
+    coerced = hue_lamp.coerce_into_gamut_batch(
+        np.array([case[2] for case in cases]), gamut)
+    for case, xy in zip(cases, coerced):
+        assert xy == pytest.approx(case[4], abs=1e-12)
+
+@pytest.mark.parametrize('gamut', (GAMUT_A, GAMUT_B, GAMUT_C))
+@pytest.mark.parametrize('gamma_correct', (True, False))
+def test_rgb_to_xy_python_matches_compiled(gamut, gamma_correct, monkeypatch):
+    hue_color = hue_lamp.hue_color
+    if hue_color is None:
+        pytest.skip('hue_color extension is not built')
+    compiled = [
+        hue_lamp.rgb_to_xy(color_rgb, gamut, gamma_correct)
+        for color_rgb in RGB_COLORS]
+    monkeypatch.setattr(hue_lamp, 'hue_color', None)
+    for color_rgb, (xy, bri) in zip(RGB_COLORS, compiled):
+        expected_xy, expected_bri = hue_lamp.rgb_to_xy(
+            color_rgb, gamut, gamma_correct)
+        assert xy == pytest.approx(expected_xy, abs=1e-12)
+        assert bri == pytest.approx(expected_bri, abs=1e-12)
+
+def test_compiled_gamut_layout_matches():
+    if hue_lamp.hue_color is None:
+        pytest.skip('hue_color extension is not built')
+    assert hue_lamp.hue_color.GAMUT_LAYOUT == hue_lamp._GAMUT_LAYOUT
+    assert len(GAMUT_A) == hue_lamp._GAMUT_SIZE
+
+
+def _make_lamp(state, ttime):
+    lamp = object.__new__(hue_lamp.HueLamp)
+    lamp.state = dict(state)
+    lamp.ttime = ttime
+    return lamp
+
+LAMP_STATES = [
+    {'on': on, 'bri': bri, 'colormode': colormode, 'xy': [0.3, 0.3], 'ct': 300}
+    for on, bri, colormode in itertools.product(
+        (True, False), (0, 1, 100), ('xy', 'ct', 'hs'))]
+
+def _commands():
+    options = (
+        ('bri', (None, 0, 1, 100)),
+        ('xy', (None, (0.3, 0.3), (0.5, 0.4))),
+        ('ct', (None, 153, 300)),
+        ('transitiontime', (None, 0, hue_lamp._DEFAULT_TRANSITION_TIME)),
+        ('on', (None, True)),
+    )
+    names = [name for name, _ in options]
+    for values in itertools.product(*(values for _, values in options)):
+        yield {
+            name: value for name, value in zip(names, values)
+            if value is not None}
+
+def test_filter_command_fast_path_matches_slow_path(monkeypatch):
+    cases = list(itertools.product(
+        LAMP_STATES, _commands(), (hue_lamp._DEFAULT_TRANSITION_TIME, 0)))
+    fast = [
+        _make_lamp(state, ttime)._filter_command(**commands)
+        for state, commands, ttime in cases]
+    # no command qualifies for the fast path without these keys
+    monkeypatch.setattr(hue_lamp, '_FAST_PATH_KEYS', frozenset())
+    slow = [
+        _make_lamp(state, ttime)._filter_command(**commands)
+        for state, commands, ttime in cases]
+    assert fast == slow
+
+
+class FakeLight (object):
+    def __init__(self):
+        self.calls = []
+
+    def state(self, **commands):
+        self.calls.append(commands)
+
+def test_send_command_skips_unchanged_lamp():
+    state = {'on': True, 'bri': 100, 'colormode': 'xy', 'xy': [0.3, 0.3]}
+    lamp = _make_lamp(state, hue_lamp._DEFAULT_TRANSITION_TIME)
+    lamp.light = FakeLight()
+
+    lamp.send_command(bri=100, xy=(0.3, 0.3))
+    assert lamp.light.calls == []
+
+    lamp.send_command(bri=101, xy=(0.3, 0.3))
+    assert lamp.light.calls == [{'bri': 101}]